@@ -5,13 +5,22 @@ from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from scipy import stats
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
+@st.cache_resource
+def get_rng():
+    # Um único Generator para todas as execuções; o app é reexecutado a cada interação
+    return np.random.default_rng()
+
+def normalize_ticker(ticker):
+    # Recebe o ticker já sem espaços e em maiúsculas; só acrescenta o sufixo da B3
+    return ticker if ticker.endswith('.SA') else ticker + '.SA'
+
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_stock_data(ticker, start_date, end_date):
-    ticker = ticker.upper()
-    if not ticker.endswith('.SA'):
-        ticker += '.SA'
-    
+    # Espera o símbolo canônico (ex: PETR4.SA), vindo de normalize_ticker
     stock = yf.Ticker(ticker)
     data = stock.history(start=start_date, end=end_date)
     
@@ -19,6 +28,7 @@ def get_stock_data(ticker, start_date, end_date):
         raise ValueError(f"Não foi possível obter dados para o ticker {ticker}")
     return data
 
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_dif26_data(start_date, end_date):
     dif26 = yf.Ticker('DI1F26.SA')  # Símbolo do DIF26 na B3
     data = dif26.history(start=start_date, end=end_date)
@@ -28,31 +38,47 @@ def calculate_percentage_change(current_price, target_price):
     return ((target_price - current_price) / current_price) * 100
 
 def calculate_volatility(data):
-    returns = data['Close'].pct_change().dropna()
-    volatility = returns.std() * np.sqrt(252)
+    closes = data['Close'].to_numpy(dtype=np.float64)
+    returns = np.diff(np.log(closes))
+    volatility = np.nanstd(returns, ddof=1) * np.sqrt(252)
     return volatility
 
-def monte_carlo_simulation(current_price, volatility, days, num_simulations=10000):
+def monte_carlo_simulation(current_price, volatility, days, num_simulations=50):
     dt = 1/252
     mu = 0
-    
-    random_walks = np.exp(
-        (mu - 0.5 * volatility**2) * dt +
-        volatility * np.sqrt(dt) * np.random.normal(size=(num_simulations, days))
-    )
-    
-    price_paths = current_price * np.cumprod(random_walks, axis=1)
-    
+
+    drift = np.float32((mu - 0.5 * volatility**2) * dt)
+    diffusion = np.float32(volatility * np.sqrt(dt))
+
+    price_paths = get_rng().standard_normal(size=(num_simulations, days), dtype=np.float32)
+    price_paths *= diffusion
+    price_paths += drift
+    # cumprod(exp(x)) == exp(cumsum(x)): acumula os log-retornos e aplica exp uma vez
+    np.cumsum(price_paths, axis=1, out=price_paths)
+    np.exp(price_paths, out=price_paths)
+    price_paths *= np.float32(current_price)
+
     return price_paths
 
+@st.cache_data(show_spinner=False)
+def future_business_days(last_date, days):
+    return pd.date_range(start=last_date, periods=days+1, freq='B')[1:]
+
+def terminal_prob(current_price, volatility, days, target_price):
+    # Com mu = 0, o preço final é log-normal: P(S_T >= K) sai direto da CDF normal
+    t = days / 252
+    z = (np.log(target_price / current_price) + 0.5 * volatility**2 * t) / (volatility * np.sqrt(t))
+    return stats.norm.sf(z)
+
 def analyze_dif26_impact(stock_data, dif26_data):
     # Alinha os dados da ação com os dados do DIF26
-    aligned_data = pd.concat([stock_data['Close'], dif26_data], axis=1).dropna()
+    stock_close, dif26_close = stock_data['Close'].align(dif26_data, join='inner')
+    valid = ~(stock_close.isna() | dif26_close.isna()).to_numpy()
     
-    if aligned_data.empty:
+    if valid.sum() < 2:
         return "Não há dados suficientes para analisar a correlação entre a ação e o DIF26."
 
-    correlation = aligned_data.iloc[:, 0].corr(aligned_data.iloc[:, 1])
+    correlation = float(np.corrcoef(stock_close.to_numpy()[valid], dif26_close.to_numpy()[valid])[0, 1])
     dif26_trend = dif26_data.iloc[-1] - dif26_data.iloc[0] if len(dif26_data) > 1 else 0
 
     analysis = ""
@@ -72,111 +98,141 @@ def analyze_dif26_impact(stock_data, dif26_data):
     
     return analysis
 
+def build_bar_figure(ticker, lowest_price, current_price, highest_price, target_price_1, target_price_2):
+    change_to_target_1 = calculate_percentage_change(current_price, target_price_1)
+    change_to_target_2 = calculate_percentage_change(current_price, target_price_2)
+    change_from_lowest = calculate_percentage_change(lowest_price, current_price)
+    change_to_highest = calculate_percentage_change(current_price, highest_price)
+
+    fig = go.Figure()
+
+    fig.add_trace(go.Bar(
+        x=['Menor Preço', 'Preço Atual', 'Maior Preço', 'Alvo 1', 'Alvo 2'],
+        y=[lowest_price, current_price, highest_price, target_price_1, target_price_2],
+        text=[
+            f'R${lowest_price:.2f}<br>({change_from_lowest:.2f}%)',
+            f'R${current_price:.2f}',
+            f'R${highest_price:.2f}<br>({change_to_highest:.2f}%)',
+            f'R${target_price_1:.2f}<br>({change_to_target_1:.2f}%)',
+            f'R${target_price_2:.2f}<br>({change_to_target_2:.2f}%)'
+        ],
+        textposition='inside',
+        marker_color=['purple', 'blue', 'orange', 'red', 'green']
+    ))
+
+    fig.update_layout(
+        title=f'Comparação de Preços para {ticker}',
+        yaxis_title='Preço (R$)',
+        showlegend=False
+    )
+
+    return fig
+
+@st.fragment
+def render_targets(ticker, data, dif26_data, current_price, lowest_price, highest_price,
+                   volatility, days, mc_simulations, dates_future):
+    # Os preços-alvo ficam num fragmento: alterá-los só reexecuta este bloco,
+    # fora do try/except de main, por isso o tratamento de erro é repetido aqui
+    try:
+        target_price_1 = st.number_input("Digite o primeiro preço-alvo (R$):", min_value=0.01, step=0.01)
+        target_price_2 = st.number_input("Digite o segundo preço-alvo (R$):", min_value=0.01, step=0.01)
+
+        prob_target_1 = terminal_prob(current_price, volatility, days, target_price_1)
+        prob_target_2 = terminal_prob(current_price, volatility, days, target_price_2)
+
+        # Exibição dos resultados
+        st.subheader(f"Análise de Probabilidades ({days} dias)")
+        st.write(f"Volatilidade anualizada: {volatility*100:.2f}%")
+        st.write(f"Probabilidade de atingir Alvo 1 (R${target_price_1:.2f}) em {days} dias: {prob_target_1*100:.2f}%")
+        st.write(f"Probabilidade de atingir Alvo 2 (R${target_price_2:.2f}) em {days} dias: {prob_target_2*100:.2f}%")
+
+        # Gráfico de barras
+        fig = build_bar_figure(ticker, lowest_price, current_price, highest_price, target_price_1, target_price_2)
+        st.plotly_chart(fig)
+
+        # Gráfico histórico com algumas simulações de Monte Carlo e DIF26
+        fig_hist = make_subplots(specs=[[{"secondary_y": True}]])
+        # Períodos longos são reduzidos a fechamentos semanais para aliviar o gráfico
+        hist_close = data['Close']
+        if len(hist_close) > 500:
+            # Mantém a data real do último pregão de cada semana
+            hist_close = hist_close.dropna()
+            hist_close = hist_close.groupby(hist_close.index.tz_localize(None).to_period('W')).tail(1)
+        fig_hist.add_trace(go.Scatter(x=hist_close.index, y=hist_close, mode='lines', name='Preço Histórico'))
+
+        # Adicionando algumas simulações ao gráfico
+        num_simulations = len(mc_simulations)
+        # Um único trace WebGL; os NaN/NaT entre trajetórias fazem o Plotly quebrar a linha
+        sim_x = np.tile(np.append(dates_future.tz_localize(None).values, np.datetime64('NaT')), num_simulations)
+        sim_y = np.column_stack([mc_simulations, np.full(num_simulations, np.nan)]).ravel()
+        fig_hist.add_trace(go.Scattergl(x=sim_x, y=sim_y, mode='lines', opacity=0.1,
+                                        line=dict(color='gray'), showlegend=False, hoverinfo='skip'))
+
+        # Adicionando DIF26 ao gráfico
+        if not dif26_data.empty:
+            fig_hist.add_trace(go.Scatter(x=dif26_data.index, y=dif26_data, mode='lines', name='DIF26'), secondary_y=True)
+
+        fig_hist.add_hline(y=current_price, line_dash="dash", line_color="blue", annotation_text="Preço Atual")
+        fig_hist.add_hline(y=target_price_1, line_dash="dash", line_color="red", annotation_text="Alvo 1")
+        fig_hist.add_hline(y=target_price_2, line_dash="dash", line_color="green", annotation_text="Alvo 2")
+        fig_hist.update_layout(
+            title=f'Histórico de Preços, Simulações de Monte Carlo e DIF26 para {ticker}', 
+            xaxis_title='Data', 
+            yaxis_title='Preço da Ação (R$)',
+            yaxis2_title='DIF26',
+            legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+        )
+        st.plotly_chart(fig_hist)
+    except Exception as e:
+        st.error(f"Erro ao processar dados: {e}")
+
 def main():
     st.title("Análise de Ações Brasileiras com Simulação de Monte Carlo e DIF26")
 
-    ticker = st.text_input("Digite o ticker da ação brasileira (ex: PETR4, VALE3):").upper()
+    ticker = st.text_input("Digite o ticker da ação brasileira (ex: PETR4, VALE3):").strip().upper()
     
     end_date = datetime.now().date()
     start_date = end_date - timedelta(days=365)
     start_date = st.date_input("Data inicial", value=start_date)
     end_date = st.date_input("Data final", value=end_date)
 
-    target_price_1 = st.number_input("Digite o primeiro preço-alvo (R$):", min_value=0.01, step=0.01)
-    target_price_2 = st.number_input("Digite o segundo preço-alvo (R$):", min_value=0.01, step=0.01)
-
-    if ticker and target_price_1 and target_price_2 and start_date < end_date:
+    if ticker and start_date < end_date:
         try:
-            data = get_stock_data(ticker, start_date, end_date)
-            dif26_data = get_dif26_data(start_date, end_date)
+            # Baixa os dados da ação e do DIF26 em paralelo; as threads recebem o contexto
+            # da execução para que as funções com st.cache_data funcionem nelas
+            with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx,
+                                    initargs=(None, get_script_run_ctx())) as executor:
+                stock_future = executor.submit(get_stock_data, normalize_ticker(ticker), start_date, end_date)
+                dif26_future = executor.submit(get_dif26_data, start_date, end_date)
+                data = stock_future.result()
+                dif26_data = dif26_future.result()
             
             if data.empty:
                 st.error("Não foi possível obter dados para a ação selecionada.")
                 return
 
-            current_price = data['Close'].iloc[-1]
-            lowest_price = data['Close'].min()
-            highest_price = data['Close'].max()
+            closes = data['Close'].to_numpy()
+            current_price, lowest_price, highest_price = closes[-1], np.nanmin(closes), np.nanmax(closes)
 
             st.write(f"Preço atual de {ticker}: R${current_price:.2f}")
 
-            change_to_target_1 = calculate_percentage_change(current_price, target_price_1)
-            change_to_target_2 = calculate_percentage_change(current_price, target_price_2)
-            change_from_lowest = calculate_percentage_change(lowest_price, current_price)
-            change_to_highest = calculate_percentage_change(current_price, highest_price)
-
             volatility = calculate_volatility(data)
 
             # Monte Carlo Simulation para 30 dias
             days_30 = 30
-            num_simulations = 10000
+            # As probabilidades vêm da fórmula fechada; só simulamos as trajetórias do gráfico
+            num_simulations = 50
             mc_simulations = monte_carlo_simulation(current_price, volatility, days_30, num_simulations)
-            
-            prob_mc_target_1 = np.mean(mc_simulations[:, -1] >= target_price_1)
-            prob_mc_target_2 = np.mean(mc_simulations[:, -1] >= target_price_2)
+            dates_future = future_business_days(data.index[-1], days_30)
 
-            # Exibição dos resultados
-            st.subheader("Análise de Probabilidades (30 dias)")
-            st.write(f"Volatilidade anualizada: {volatility*100:.2f}%")
-            st.write(f"Probabilidade de atingir Alvo 1 (R${target_price_1:.2f}) em 30 dias: {prob_mc_target_1*100:.2f}%")
-            st.write(f"Probabilidade de atingir Alvo 2 (R${target_price_2:.2f}) em 30 dias: {prob_mc_target_2*100:.2f}%")
+            render_targets(ticker, data, dif26_data, current_price, lowest_price, highest_price,
+                           volatility, days_30, mc_simulations, dates_future)
 
             # Análise do DIF26
             dif26_analysis = analyze_dif26_impact(data, dif26_data)
             st.subheader("Análise do impacto do DIF26:")
             st.write(dif26_analysis)
 
-            # Gráfico de barras
-            fig = go.Figure()
-
-            fig.add_trace(go.Bar(
-                x=['Menor Preço', 'Preço Atual', 'Maior Preço', 'Alvo 1', 'Alvo 2'],
-                y=[lowest_price, current_price, highest_price, target_price_1, target_price_2],
-                text=[
-                    f'R${lowest_price:.2f}<br>({change_from_lowest:.2f}%)',
-                    f'R${current_price:.2f}',
-                    f'R${highest_price:.2f}<br>({change_to_highest:.2f}%)',
-                    f'R${target_price_1:.2f}<br>({change_to_target_1:.2f}%)',
-                    f'R${target_price_2:.2f}<br>({change_to_target_2:.2f}%)'
-                ],
-                textposition='auto',
-                marker_color=['purple', 'blue', 'orange', 'red', 'green']
-            ))
-
-            fig.update_layout(
-                title=f'Comparação de Preços para {ticker}',
-                yaxis_title='Preço (R$)',
-                showlegend=False
-            )
-
-            st.plotly_chart(fig)
-
-            # Gráfico histórico com algumas simulações de Monte Carlo e DIF26
-            fig_hist = make_subplots(specs=[[{"secondary_y": True}]])
-            fig_hist.add_trace(go.Scatter(x=data.index, y=data['Close'], mode='lines', name='Preço Histórico'))
-            
-            # Adicionando algumas simulações ao gráfico
-            dates_future = pd.date_range(start=data.index[-1], periods=days_30+1, freq='B')[1:]
-            for i in range(min(50, num_simulations)):
-                fig_hist.add_trace(go.Scatter(x=dates_future, y=mc_simulations[i], mode='lines', 
-                                              opacity=0.1, line=dict(color='gray'), showlegend=False))
-
-            # Adicionando DIF26 ao gráfico
-            if not dif26_data.empty:
-                fig_hist.add_trace(go.Scatter(x=dif26_data.index, y=dif26_data, mode='lines', name='DIF26'), secondary_y=True)
-
-            fig_hist.add_hline(y=current_price, line_dash="dash", line_color="blue", annotation_text="Preço Atual")
-            fig_hist.add_hline(y=target_price_1, line_dash="dash", line_color="red", annotation_text="Alvo 1")
-            fig_hist.add_hline(y=target_price_2, line_dash="dash", line_color="green", annotation_text="Alvo 2")
-            fig_hist.update_layout(
-                title=f'Histórico de Preços, Simulações de Monte Carlo e DIF26 para {ticker}', 
-                xaxis_title='Data', 
-                yaxis_title='Preço da Ação (R$)',
-                yaxis2_title='DIF26',
-                legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-            )
-            st.plotly_chart(fig_hist)
-
             # Novo gráfico específico para o DIF26
             if not dif26_data.empty:
                 fig_dif26 = go.Figure()